@@ -0,0 +1,59 @@
+"""
+Compares JSON codecs on typical `ui` and `update` frames.
+
+Usage: python benchmarks/codec.py [NUMBER]
+"""
+import asyncio
+import importlib
+import sys
+import timeit
+
+from gyverhubd import Layout, Color, codec
+
+
+def make_ui() -> dict:
+    ui = Layout()
+    ui.Title("Controls")
+    for i in range(20):
+        with ui.rows(cols=3):
+            ui.Button(f"Button {i}", color=Color.RED)
+            ui.Slider(f"Slider {i}", min=0, value=i, max=100, step=0.5, color=Color.PINK)
+            ui.Switch(f"Switch {i}", color=Color.BLUE)
+
+    ui.Title("Sensors")
+    for i in range(20):
+        ui.Gauge(f"Temp {i}", text="°C", value=20.5, min=-5, max=30, step=0.1)
+        ui.Label(f"Status {i}", value="OK")
+
+    frame = asyncio.run(ui.on_update())
+    # Plain dicts, so codecs do not reuse encoded fragments cached by components
+    frame['controls'] = [dict(i) for i in frame['controls']]
+    return frame
+
+
+def make_update() -> dict:
+    return dict(type='update', id='8a942809', updates={f'u{i}': i * 1.5 for i in range(10)})
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    payloads = dict(ui=make_ui(), update=make_update())
+
+    print(f"{'codec':<10}{'payload':<10}{'bytes':>8}{'us/op':>10}")
+    for name in codec.CODECS:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            print(f"{name:<10}not installed")
+            continue
+
+        codec.set_codec(name)
+        for payload_name, payload in payloads.items():
+            size = len(codec.encode_frame(payload))
+            timer = timeit.Timer(lambda: codec.encode_frame(payload))
+            best = min(timer.repeat(5, number)) / number
+            print(f"{name:<10}{payload_name:<10}{size:>8}{best * 1e6:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -8,7 +8,9 @@ from .context import *
 from .info import *
 from .filesystem import *
 from .ui import *
+from .ota import *
 from .device import *
+from .dispatcher import *
 from .server import *
 from .device_utils import *
 
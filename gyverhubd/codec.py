@@ -0,0 +1,115 @@
+import json
+import typing
+
+__all__ = ["CODECS", "name", "dumps", "encode_frame", "set_codec", "JsonFragment"]
+
+CODECS: typing.Tuple[str, ...] = ('orjson', 'msgspec', 'json')
+
+name: str
+dumps: typing.Callable[[typing.Any], bytes]
+# Wraps already encoded JSON so the codec embeds it as is, None if codec does not support that
+_raw: typing.Optional[typing.Callable[[bytes], typing.Any]]
+
+
+class JsonFragment(dict):
+    """
+    dict that keeps its encoded form. encode_frame() embeds it without encoding again when codec supports that
+    """
+    __slots__ = ('_encoded', )
+
+    def __init__(self, value: dict):
+        super().__init__(value)
+        self._encoded: typing.Optional[bytes] = None
+
+    @property
+    def encoded(self) -> bytes:
+        """
+        Encoded on first use, so codecs that cannot embed it never encode it twice
+        """
+        if self._encoded is None:
+            self._encoded = dumps(dict(self))
+        return self._encoded
+
+    def copy(self) -> 'JsonFragment':
+        res = JsonFragment(self)
+        # Share the encoded form with the copy only when it will be embedded
+        res._encoded = self._encoded if _raw is None else self.encoded
+        return res
+
+
+def _default(obj):
+    # int subclasses (Color, enums) and other containers that fast codecs do not support natively
+    if isinstance(obj, int):
+        return int(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _load(codec: str) -> typing.Tuple[typing.Callable[[typing.Any], bytes], typing.Optional[typing.Callable]]:
+    if codec == 'orjson':
+        import orjson
+
+        def _dumps(data) -> bytes:
+            return orjson.dumps(data, default=_default)
+
+        # Fragment is available since orjson 3.9
+        return _dumps, getattr(orjson, 'Fragment', None)
+
+    if codec == 'msgspec':
+        import msgspec
+
+        encoder = msgspec.json.Encoder(enc_hook=_default)
+        return encoder.encode, msgspec.Raw
+
+    if codec == 'json':
+        encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=_default)
+
+        def _dumps(data) -> bytes:
+            return encoder.encode(data).encode()
+
+        return _dumps, None
+
+    raise ValueError(f"Unknown JSON codec {codec!r}")
+
+
+def set_codec(codec: typing.Optional[str] = None):
+    """
+    Selects JSON codec used for all wire encoding. When codec is None, the fastest installed one is used
+    """
+    global name, dumps, _raw
+
+    if codec is not None:
+        (dumps, _raw), name = _load(codec), codec
+        return
+
+    for i in CODECS:
+        try:
+            (dumps, _raw), name = _load(i), i
+        except ImportError:
+            continue
+        return
+
+
+def _embed(data):
+    """
+    Replaces fragments in top-level lists of the frame (like ui controls) with their encoded form
+    """
+    if _raw is None or not isinstance(data, dict):
+        return data
+
+    res = None
+    for key, value in data.items():
+        if isinstance(value, list) and any(isinstance(i, JsonFragment) for i in value):
+            if res is None:
+                res = dict(data)
+            res[key] = [_raw(i.encoded) if isinstance(i, JsonFragment) else i for i in value]
+
+    return data if res is None else res
+
+
+def encode_frame(data) -> bytes:
+    return b'\n' + dumps(_embed(data)) + b'\n'
+
+
+set_codec()
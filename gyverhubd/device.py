@@ -1,9 +1,10 @@
+import asyncio
 import binascii
 import typing
 from functools import cached_property
 
 from . import Filesystem, response, DeviceUi, Module, DeviceInfo, __version__, generate_did, EventTarget, request, \
-    server
+    server, OtaUpdate, Layout
 
 __all__ = ["Device"]
 
@@ -30,6 +31,8 @@ class Device(EventTarget):
     fs: typing.Optional[Filesystem] = None
     ui: typing.Optional[DeviceUi] = None
     ota_parts: tuple = ()  # may contain 'fs' or 'flash'
+    ota_max_size: typing.Optional[int] = None
+    update_interval: typing.Optional[float] = None  # merge updates sent during interval (in seconds) into one frame
 
     # Overridable
 
@@ -48,6 +51,9 @@ class Device(EventTarget):
     async def ota_update(self, part: str, data: bytes):
         raise NotImplementedError()
 
+    async def ota_update_stream(self, update: OtaUpdate):
+        await self.ota_update(update.part, update.read())
+
     async def ota_url(self, part: str, url: str):
         raise NotImplementedError()
 
@@ -65,12 +71,12 @@ class Device(EventTarget):
     async def send(self, typ, **data):
         data['id'] = self.id
         data['type'] = typ
-        await server.send(data)
+        await server.send(data, prefix=self.prefix)
 
     async def broadcast(self, typ, **data):
         data['id'] = self.id
         data['type'] = typ
-        await server.send(data, broadcast=True)
+        await server.send(data, broadcast=True, prefix=self.prefix)
 
     async def send_push(self, text: str, *, broadcast=False):
         if broadcast:
@@ -91,13 +97,73 @@ class Device(EventTarget):
             await self.send("alert", text=text)
 
     async def send_update(self, name: str, value: str, *, broadcast=False):
+        if self.update_interval is None:
+            if broadcast:
+                await self.broadcast("update", updates={name: value})
+            else:
+                await self.send("update", updates={name: value})
+            return
+
         if broadcast:
-            await self.broadcast("update", updates={name: value})
+            self._broadcast_updates[name] = value
+            self._updates.pop(name, None)
         else:
-            await self.send("update", updates={name: value})
+            self._updates[name] = value
+        self._schedule_updates()
+
+    def ota_begin(self, part: str) -> OtaUpdate:
+        return OtaUpdate(part, self.ota_max_size)
+
+    async def ota_finish(self, update: OtaUpdate):
+        with update:
+            await self.ota_update_stream(update)
 
     # internal
 
+    def _schedule_updates(self):
+        if self._update_task is not None:
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:  # changes will be sent with the next response
+            return
+
+        self._update_task = loop.create_task(self._flush_updates())
+
+    async def _flush_updates(self):
+        """
+        Sends all updates collected during update_interval
+        """
+        try:
+            await asyncio.sleep(self.update_interval)
+        finally:
+            self._update_task = None
+
+        updates, self._updates = self._updates, {}
+        broadcast, self._broadcast_updates = self._broadcast_updates, {}
+
+        try:
+            if isinstance(self.ui, Layout):
+                data = self.ui.collect_pushes()
+                if data is None:
+                    pass
+                elif data['type'] == 'ui':
+                    await self.send("ui", controls=data['controls'])
+                else:
+                    updates = {**data['updates'], **updates}
+
+            if broadcast:
+                await self.broadcast("update", updates=broadcast)
+            if updates:
+                await self.send("update", updates=updates)
+
+        except Exception as e:
+            asyncio.get_running_loop().call_exception_handler({
+                'message': f"Exception while sending updates ({self.prefix}/{self.id})",
+                'exception': e,
+            })
+
     @cached_property
     def _disabled_modules(self):
         value = 0
@@ -105,7 +171,8 @@ class Device(EventTarget):
             value |= Module.INFO
         if type(self).reboot == Device.reboot:  # not overrided
             value |= Module.REBOOT
-        if type(self).ota_update == Device.ota_update:  # not overrided
+        if type(self).ota_update == Device.ota_update and \
+                type(self).ota_update_stream == Device.ota_update_stream:  # not overrided
             value |= Module.OTA
         if type(self).ota_url == Device.ota_url:  # not overrided
             value |= Module.OTA_URL
@@ -120,10 +187,17 @@ class Device(EventTarget):
 
     def __init__(self):
         super().__init__()
-        self._ota_data = self._ota_name = None
+        self._ota: typing.Optional[OtaUpdate] = None
+        self._updates: typing.Dict[str, typing.Any] = {}
+        self._broadcast_updates: typing.Dict[str, typing.Any] = {}
+        self._update_task: typing.Optional[asyncio.Task] = None
         if self.id is None:
             self.id = generate_did(type(self))
 
+        if self.update_interval is not None and isinstance(self.ui, Layout):
+            # Push changes made outside of requests, e.g. sensor values assigned to components
+            self.ui.watch(self._schedule_updates)
+
         self.add_event_listener('discover', self._on_discover)
         self.add_event_listener('request', self._on_request)
 
@@ -213,27 +287,35 @@ class Device(EventTarget):
                 await request.respond(response("ERR", text="Cant update this partition"))
                 return
 
-            self._ota_name = request.name
-            self._ota_data = []
+            if self._ota is not None:
+                self._ota.close()
+            self._ota = self.ota_begin(request.name)
             await request.respond(response("ota_start"))
             return
 
         if cmd == "ota_chunk":
-            if self._ota_data is None:
+            if self._ota is None:
                 await request.respond(response("ota_err"))
                 return
 
-            self._ota_data.append(binascii.a2b_base64(request.value))
+            update = self._ota
+            try:
+                await update.awrite(binascii.a2b_base64(request.value))
+            except Exception:
+                self._ota = None
+                update.close()
+                await request.respond(response("ota_err"))
+                return
 
             if request.name == 'next':
                 await request.respond(response("ota_next_chunk"))
                 return
 
+            self._ota = None
             try:
-                await self.ota_update(self._ota_name, b''.join(self._ota_data))
+                await self.ota_finish(update)
             except Exception:
                 await request.respond(response("ota_err"))
             else:
-                self._ota_name = self._ota_data = None
                 await request.respond(response("ota_end"))
             return
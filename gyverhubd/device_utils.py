@@ -1,4 +1,3 @@
-import io
 import os
 import sys
 import typing
@@ -9,7 +8,7 @@ from Crypto.Hash import SHA3_256
 from Crypto.PublicKey import DSA
 from Crypto.Signature import DSS
 
-from gyverhubd import context, Server, hash_file
+from gyverhubd import context, Server, hash_file, OtaUpdate, run_io
 
 __all__ = ['download_and_update', 'restart_app']
 
@@ -18,9 +17,16 @@ async def download_and_update(dev, part: str, url: str):
     async with aiohttp.ClientSession() as sess:
         async with sess.get(url) as resp:
             resp.raise_for_status()
-            data = await resp.read()
 
-    await dev.ota_update(part, data)
+            update = dev.ota_begin(part)
+            try:
+                async for chunk in resp.content.iter_chunked(64 * 1024):
+                    await update.awrite(chunk)
+            except BaseException:
+                update.close()
+                raise
+
+    await dev.ota_finish(update)
 
 
 async def restart_app(_):
@@ -30,7 +36,13 @@ async def restart_app(_):
 
 
 async def install_update(dev, part: str, data: bytes):
-    if part != 'flash':
+    with OtaUpdate(part) as update:
+        await update.awrite(data)
+        await install_update_stream(dev, update)
+
+
+async def install_update_stream(dev, update: OtaUpdate):
+    if update.part != 'flash':
         raise ValueError("You can only update flash")
 
     typ = type(dev)
@@ -44,11 +56,9 @@ async def install_update(dev, part: str, data: bytes):
         key = None
 
     if key is not None:
-        with io.BytesIO(data) as fp:
-            validate_package(fp, key)
+        await run_io(validate_package, update.file, key)
 
-    with open(loader.archive + '.tmp', 'wb') as f:
-        f.write(data)
+    await update.asave(loader.archive + '.tmp')
 
     server: Server = context.server
     os.environ['__SRV_AUTO_RESTART'] = '1'
@@ -0,0 +1,188 @@
+import asyncio
+import collections
+import typing
+
+from . import Request
+
+__all__ = ["Dispatcher"]
+
+_POLICIES = frozenset(('block', 'drop'))
+
+
+class Dispatcher:
+    def __init__(self, *, max_in_flight: int = 64, client_queue_size: int = 32, device_queue_size: int = 64,
+                 overflow: str = 'block', coalesce_window: typing.Optional[float] = None):
+        if overflow not in _POLICIES:
+            raise ValueError(f"Invalid overflow policy {overflow!r}")
+
+        self.max_in_flight = max_in_flight
+        self.client_queue_size = client_queue_size
+        self.device_queue_size = device_queue_size
+        self.overflow = overflow
+        self.coalesce_window = coalesce_window
+        self.dropped = 0
+        self.coalesced = 0
+
+        self._server = None
+        self._tasks: typing.Set[asyncio.Task] = set()
+        self._lanes: typing.Dict[typing.Tuple[str, typing.Optional[str]], _Lane] = {}
+        self._pending = 0
+        self._running = 0
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._released = asyncio.Condition()
+        self._clients: typing.Counter[typing.Hashable] = collections.Counter()
+        self._devices: typing.Counter[typing.Tuple[str, typing.Optional[str]]] = collections.Counter()
+
+    def bind(self, server):
+        self._server = server
+        server.add_event_listener('stop', self.__server_stop)
+
+    # Counters
+
+    @property
+    def queue_depth(self) -> int:
+        return self._pending
+
+    @property
+    def in_flight(self) -> int:
+        return self._running
+
+    @property
+    def client_depths(self) -> typing.Dict[typing.Hashable, int]:
+        return dict(self._clients)
+
+    @property
+    def device_depths(self) -> typing.Dict[typing.Tuple[str, typing.Optional[str]], int]:
+        return dict(self._devices)
+
+    # API
+
+    async def submit(self, req: Request) -> bool:
+        """
+        Schedules request processing. Waits for free queue space or returns False when the request was dropped
+        """
+        client, dev = req.client, (req.prefix, req.did)
+
+        if self.coalesce_window is not None and req.cmd == 'set' and self._coalesce(req, client, dev):
+            return True
+
+        if self._is_full(client, dev):
+            if self.overflow == 'drop':
+                self.dropped += 1
+                return False
+
+            async with self._released:
+                await self._released.wait_for(lambda: not self._is_full(client, dev))
+
+        self._clients[client] += 1
+        self._devices[dev] += 1
+        self._pending += 1
+
+        lane = self._lanes.get(dev)
+        if lane is None:
+            lane = self._lanes[dev] = _Lane()
+
+        # Request, its client and arrival time
+        entry = [req, client, asyncio.get_running_loop().time()]
+        lane.queue.append(entry)
+        if self.coalesce_window is not None and req.cmd == 'set':
+            lane.sets[req.name] = entry
+
+        if lane.worker is None:
+            lane.worker = asyncio.create_task(self._drain(dev, lane))
+            self._tasks.add(lane.worker)
+            lane.worker.add_done_callback(self._tasks.discard)
+
+        return True
+
+    # internal
+
+    def _coalesce(self, req: Request, client, dev) -> bool:
+        """
+        Replaces value of the queued 'set' request for the same component. Returns False if there is none
+        """
+        lane = self._lanes.get(dev)
+        entry = None if lane is None else lane.sets.get(req.name)
+        if entry is None:
+            return False
+
+        if entry[1] != client:
+            _release(self._clients, entry[1])
+            self._clients[client] += 1
+
+        entry[0], entry[1] = req, client
+        self.coalesced += 1
+        return True
+
+    def _is_full(self, client, dev) -> bool:
+        return self._clients[client] >= self.client_queue_size or self._devices[dev] >= self.device_queue_size
+
+    async def _drain(self, dev, lane: '_Lane'):
+        """
+        Lane worker, runs queued requests of one device in arrival order
+        """
+        try:
+            while lane.queue:
+                entry = lane.queue.popleft()
+                try:
+                    if entry[0].cmd == 'set' and lane.sets.get(entry[0].name) is entry:
+                        # Keep entry open for coalescing until its window, counted from arrival, ends
+                        delay = entry[2] + self.coalesce_window - asyncio.get_running_loop().time()
+                        if delay > 0:
+                            await asyncio.sleep(delay)
+                        del lane.sets[entry[0].name]
+
+                    await self._run(entry[0])
+                finally:
+                    await self._release(entry[1], dev)
+
+        finally:
+            lane.sets.clear()
+            while lane.queue:
+                _, client, _ = lane.queue.popleft()
+                await self._release(client, dev)
+
+            lane.worker = None
+            if self._lanes.get(dev) is lane:
+                del self._lanes[dev]
+
+    async def _run(self, req: Request):
+        async with self._slots:
+            self._running += 1
+            try:
+                await self._server.dispatch_event('request', req)
+            except Exception as e:
+                asyncio.get_running_loop().call_exception_handler({
+                    'message': f"Exception in request handler ({req.prefix}/{req.did}/{req.cmd})",
+                    'exception': e,
+                })
+            finally:
+                self._running -= 1
+
+    async def _release(self, client, dev):
+        self._pending -= 1
+        _release(self._clients, client)
+        _release(self._devices, dev)
+        async with self._released:
+            self._released.notify_all()
+
+    async def __server_stop(self):
+        current = asyncio.current_task()
+        for task in tuple(self._tasks):
+            if task is not current:
+                task.cancel()
+
+
+class _Lane:
+    __slots__ = ('queue', 'sets', 'worker')
+
+    def __init__(self):
+        self.queue: typing.Deque[typing.List] = collections.deque()
+        self.sets: typing.Dict[str, typing.List] = {}
+        self.worker: typing.Optional[asyncio.Task] = None
+
+
+def _release(counter: collections.Counter, key):
+    counter[key] -= 1
+    if counter[key] <= 0:
+        del counter[key]
@@ -1,4 +1,5 @@
-__all__ = ["GyverHubError", "ReadonlyFilesystemError", "FileNotExistsError", "FilePermissionsError"]
+__all__ = ["GyverHubError", "ReadonlyFilesystemError", "FileNotExistsError", "FilePermissionsError",
+           "NotEnoughSpaceError"]
 
 
 class GyverHubError(Exception):
@@ -21,3 +22,7 @@ class FileNotExistsError(GyverHubError):
 
 class FilePermissionsError(GyverHubError):
     message = "insufficient permissions"
+
+
+class NotEnoughSpaceError(GyverHubError):
+    message = "Not enough space"
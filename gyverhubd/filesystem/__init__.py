@@ -1,4 +1,6 @@
 from . import vfspath
+from .executor import *
+from .upload import *
 from .base import *
 from .mapped import *
 from .mapped_file import *
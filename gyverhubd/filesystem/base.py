@@ -1,18 +1,24 @@
+import asyncio
 import binascii
 import io
 import typing
 
+from . import FileUpload, SpooledUpload, call_io
 from .. import response, Module, ReadonlyFilesystemError, request
 
 __all__ = ["Filesystem"]
 
 
 class Filesystem:
-    __slots__ = ('__fetch_temp', '__upload_data', '__upload_name', '_device', 'writable')
+    __slots__ = ('__fetch_file', '__fetch_chunk', '__fetch_amount', '__fetch_blocking', '__upload', '__upload_timer',
+                 '__upload_blocking', '_device', 'writable', 'chunk_size', 'upload_timeout')
 
     size: int
     used: int
     writable: bool
+    chunk_size: int
+    upload_timeout: float
+    blocking: bool = True  # run operations in the I/O thread pool
 
     # Overridable
 
@@ -47,12 +53,72 @@ class Filesystem:
             return io.StringIO(self.get_contents(path).decode())
         raise NotImplementedError()
 
+    def open_upload(self, path: str) -> FileUpload:
+        return SpooledUpload(self, path)
+
+    def real_path(self, path: str) -> typing.Optional[str]:
+        """
+        Returns path of the file on the local disk or None if file is not stored on it
+        """
+        return None
+
+    def invalidate(self, path: str):
+        """
+        Notifies filesystem that the file was changed bypassing its API
+        """
+        pass
+
+    def can_delete(self, path: str) -> bool:
+        """
+        Returns False if delete() of the file is known to be forbidden
+        """
+        return self.writable
+
+    def is_blocking(self, path: str) -> bool:
+        """
+        Returns True if operations on the file must run in the I/O thread pool
+        """
+        return self.blocking
+
+    # Async API
+
+    async def aget_files_info(self) -> typing.Dict[str, int]:
+        return await self._run(self.get_files_info)
+
+    async def aget_contents(self, path: str) -> bytes:
+        return await call_io(self.is_blocking(path), self.get_contents, path)
+
+    async def aput_contents(self, path: str, data: bytes):
+        await call_io(self.is_blocking(path), self.put_contents, path, data)
+
+    async def aformat(self):
+        await self._run(self.format)
+
+    async def adelete(self, path: str):
+        await call_io(self.is_blocking(path), self.delete, path)
+
+    async def arename(self, path: str, new_path: str):
+        await call_io(self.is_blocking(path) or self.is_blocking(new_path), self.rename, path, new_path)
+
+    async def aopen(self, path: str, mode="rb") -> io.IOBase:
+        return await call_io(self.is_blocking(path), self.open, path, mode)
+
+    async def aopen_upload(self, path: str) -> FileUpload:
+        return await call_io(self.is_blocking(path), self.open_upload, path)
+
+    async def _run(self, fn, *args):
+        return await call_io(self.blocking, fn, *args)
+
     # internal
 
     def __init__(self):
-        self.__fetch_temp = None
-        self.__upload_data = self.__upload_name = None
+        self.__fetch_file = None
+        self.__fetch_chunk = self.__fetch_amount = 0
+        self.__fetch_blocking = self.__upload_blocking = False
+        self.__upload = self.__upload_timer = None
         self.writable = True
+        self.chunk_size = 16 * 1024
+        self.upload_timeout = 60.0
 
     @property
     def disabled_modules(self):
@@ -75,57 +141,118 @@ class Filesystem:
     async def on_message(self) -> typing.Optional[dict]:
         cmd = request.cmd
         if cmd == "fsbr":
-            return self._send_fsbr()
+            return await self._send_fsbr()
 
         if cmd == "fetch":
-            self.__fetch_temp = self.get_contents(request.name)
+            self._close_fetch()
+            blocking = self.is_blocking(request.name)
+            file, size = await call_io(blocking, self._open_fetch, request.name)
+            self.__fetch_file = file
+            self.__fetch_blocking = blocking
+            self.__fetch_chunk = 0
+            self.__fetch_amount = max(1, -(-size // self.chunk_size))
             return response("fetch_start")
 
         if cmd == "fetch_chunk":
-            if self.__fetch_temp is None:
+            if self.__fetch_file is None:
                 return response("fetch_err")
 
-            res = response("fetch_next_chunk", chunk=0, amount=1,
-                           data=binascii.b2a_base64(self.__fetch_temp, newline=False).decode('ascii'))
-            self.__fetch_temp = None
+            try:
+                data = await call_io(self.__fetch_blocking, self.__fetch_file.read, self.chunk_size)
+            except OSError:
+                self._close_fetch()
+                return response("fetch_err")
+
+            res = response("fetch_next_chunk", chunk=self.__fetch_chunk, amount=self.__fetch_amount,
+                           data=binascii.b2a_base64(data, newline=False).decode('ascii'))
+            self.__fetch_chunk += 1
+            if self.__fetch_chunk >= self.__fetch_amount:
+                self._close_fetch()
             return res
 
         if not self.writable:
             raise ReadonlyFilesystemError()
 
         if cmd == "format":
-            self.format()
+            await self.aformat()
             return response("OK")
 
         if cmd == "rename":
-            self.rename(request.name, request.value)
-            return self._send_fsbr()
+            await self.arename(request.name, request.value)
+            return await self._send_fsbr()
 
         if cmd == "delete":
-            self.delete(request.name)
-            return self._send_fsbr()
+            await self.adelete(request.name)
+            return await self._send_fsbr()
 
         if cmd == "upload":
-            self.create(request.name)
-            self.__upload_name = request.name
-            self.__upload_data = []
+            self._abort_upload()
+            self.__upload = await self.aopen_upload(request.name)
+            self.__upload_blocking = self.is_blocking(request.name)
+            self._touch_upload()
             return response("upload_start")
 
         if cmd == "upload_chunk":
-            if self.__upload_data is None:
+            upload = self.__upload
+            if upload is None:
                 return response("upload_err")
 
-            self.__upload_data.append(binascii.a2b_base64(request.value.encode('ascii')))
-
-            if request.name == 'next':
-                return response("upload_next_chunk")
-
-            else:
-                self.put_contents(self.__upload_name, b''.join(self.__upload_data))
-                self.__upload_name = self.__upload_data = None
-                return response("upload_end")
-
-    def _send_fsbr(self):
-        fs = self.get_files_info()
+            # Abandoned upload timer must not close the file while the chunk is being written
+            self._stop_upload_timer()
+            try:
+                await call_io(self.__upload_blocking, upload.write, binascii.a2b_base64(request.value.encode('ascii')))
+                if request.name != 'next':
+                    self._abort_upload(upload)
+                    await call_io(self.__upload_blocking, upload.commit)
+                    return response("upload_end")
+            except Exception:
+                # Failed commit has already cleaned up after itself
+                if self.__upload is upload:
+                    self._abort_upload()
+                return response("upload_err")
+            except BaseException:
+                self._abort_upload()
+                raise
+
+            self._touch_upload()
+            return response("upload_next_chunk")
+
+    def _touch_upload(self):
+        """
+        (Re)starts abandoned upload timer
+        """
+        self._stop_upload_timer()
+        self.__upload_timer = asyncio.get_running_loop().call_later(self.upload_timeout, self._abort_upload)
+
+    def _stop_upload_timer(self):
+        if self.__upload_timer is not None:
+            self.__upload_timer.cancel()
+            self.__upload_timer = None
+
+    def _abort_upload(self, keep: typing.Optional[FileUpload] = None):
+        self._stop_upload_timer()
+
+        if self.__upload is not None:
+            if self.__upload is not keep:
+                self.__upload.abort()
+            self.__upload = None
+
+    def _open_fetch(self, path: str) -> typing.Tuple[io.IOBase, int]:
+        file = self.open(path, "rb")
+        try:
+            size = file.seek(0, io.SEEK_END)
+            file.seek(0)
+        except BaseException:
+            file.close()
+            raise
+        return file, size
+
+    def _close_fetch(self):
+        if self.__fetch_file is not None:
+            self.__fetch_file.close()
+            self.__fetch_file = None
+
+    async def _send_fsbr(self):
+        fs = await self.aget_files_info()
         # Allow to calculate used space in get_files_info()
         return response("fsbr", total=self.size, used=self.used, fs=fs)
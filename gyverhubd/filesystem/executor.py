@@ -0,0 +1,49 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import typing
+
+__all__ = ['run_io', 'call_io', 'set_io_workers']
+
+_T = typing.TypeVar('_T')
+
+_executor: typing.Optional[concurrent.futures.ThreadPoolExecutor] = None
+_workers = 4
+
+
+def set_io_workers(count: int):
+    """
+    Sets number of threads used for blocking filesystem operations
+    """
+    global _executor, _workers
+
+    if count < 1:
+        raise ValueError("At least one I/O worker is required")
+
+    _workers = count
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
+
+
+async def run_io(fn: typing.Callable[..., _T], *args) -> _T:
+    """
+    Runs blocking function in the I/O thread pool. Context variables (current device, request) are preserved
+    """
+    global _executor
+
+    if _executor is None:
+        _executor = concurrent.futures.ThreadPoolExecutor(_workers, thread_name_prefix='gyverhubd-io')
+
+    ctx = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(_executor, functools.partial(ctx.run, fn, *args))
+
+
+async def call_io(blocking: bool, fn: typing.Callable[..., _T], *args) -> _T:
+    """
+    Runs function in the I/O thread pool if blocking is set, directly on the event loop otherwise
+    """
+    if blocking:
+        return await run_io(fn, *args)
+    return fn(*args)
@@ -1,14 +1,66 @@
+import functools
 import os
+import threading
 import typing
 
-from . import vfspath, Filesystem
+from . import vfspath, Filesystem, AtomicFileUpload
+from .upload import UPLOAD_SUFFIX
 from .. import rmtree_exc, FileNotExistsError, FilePermissionsError, GyverHubError
 
 __all__ = ['MappedFilesystem']
 
 
+class _WriteHandle:
+    """
+    File opened for writing, updates index of the filesystem when closed
+    """
+    __slots__ = ('_file', '_on_close')
+
+    def __init__(self, file: typing.IO, on_close: typing.Callable[[], None]):
+        self._file = file
+        self._on_close = on_close
+
+    def __getattr__(self, item):
+        return getattr(self._file, item)
+
+    def __iter__(self):
+        return iter(self._file)
+
+    def close(self):
+        try:
+            self._file.close()
+        finally:
+            self._on_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class _Listing:
+    """
+    Cached listing of a directory
+    """
+    __slots__ = ('mtime', 'files', 'dirs')
+
+    def __init__(self, mtime: int):
+        self.mtime = mtime
+        self.files: typing.Dict[str, int] = {}
+        self.dirs: typing.Set[str] = set()
+
+
+@functools.lru_cache(maxsize=1024)
+def _resolve(base: str, path: str) -> typing.Optional[str]:
+    path = os.path.join(base, *vfspath.split_all(path))
+    if os.path.commonpath((path, base)) != base:
+        return None
+    return path
+
+
 class MappedFilesystem(Filesystem):
-    __slots__ = ('_base', 'size', 'used')
+    __slots__ = ('_base', 'size', 'used', '_index', '_dirs', '_stale', '_lock')
 
     def __init__(self, basedir: str, *, size=0, rw=True):
         super().__init__()
@@ -16,13 +68,21 @@ class MappedFilesystem(Filesystem):
         self.size = size
         self.used = 0
         self._base = os.path.realpath(basedir)
+        self._index: typing.Dict[str, int] = {}
+        self._dirs: typing.Dict[str, _Listing] = {}
+        self._stale: typing.Set[str] = set()
+        # Index is updated from the I/O threads
+        self._lock = threading.Lock()
         os.makedirs(self._base, exist_ok=True)
 
-    def _map(self, path: str) -> str:
-        path = os.path.join(self._base, *vfspath.split_all(path))
-        if os.path.commonpath((path, self._base)) != self._base:
+    def _map_read(self, path: str) -> str:
+        path = _resolve(self._base, path)
+        if path is None:
             raise FileNotExistsError()
+        return path
 
+    def _map_write(self, path: str) -> str:
+        path = self._map_read(path)
         try:
             os.makedirs(os.path.dirname(path), exist_ok=True)
         except FileNotFoundError:
@@ -34,26 +94,94 @@ class MappedFilesystem(Filesystem):
 
         return path
 
-    def get_files_info(self) -> typing.Dict[str, int]:
-        self.used = 0
-        res = {}
-        for root, dirs, files in os.walk(self._base, topdown=True, followlinks=False):
-            vfs_root = os.path.relpath(root, self._base)
+    # Index of files and their sizes, built from per-directory listings. A listing is read again only when mtime of
+    # its directory changes or when own write, rename or delete touched it
+
+    def _list(self, root: str, mtime: int):
+        old = self._dirs.get(root)
+        if old is not None:
+            self._drop_files(root, old)
 
-            for filename in files:
-                try:
-                    size = os.path.getsize(os.path.join(root, filename))
-                except OSError:
-                    size = 0
+        listing = _Listing(mtime)
+        try:
+            with os.scandir(root) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir():
+                            # Symlinked directories are not followed
+                            if not entry.is_symlink():
+                                listing.dirs.add(entry.name)
+                            continue
+                    except OSError:
+                        continue
+
+                    if entry.name.endswith(UPLOAD_SUFFIX):
+                        continue
+
+                    try:
+                        size = entry.stat().st_size
+                    except OSError:
+                        size = 0
+                    listing.files[entry.name] = size
+        except OSError:
+            pass
+
+        vfs_root = os.path.relpath(root, self._base)
+        for filename, size in listing.files.items():
+            self._index[vfspath.sys2vfs(vfs_root, filename)] = size
+            self.used += size
+        self._dirs[root] = listing
+
+        if old is not None:
+            for name in old.dirs - listing.dirs:
+                self._drop(os.path.join(root, name))
+
+    def _drop_files(self, root: str, listing: '_Listing'):
+        vfs_root = os.path.relpath(root, self._base)
+        for filename, size in listing.files.items():
+            del self._index[vfspath.sys2vfs(vfs_root, filename)]
+            self.used -= size
+
+    def _drop(self, root: str):
+        listing = self._dirs.pop(root, None)
+        if listing is not None:
+            self._drop_files(root, listing)
+            for name in listing.dirs:
+                self._drop(os.path.join(root, name))
+
+    def _sync(self):
+        stale = self._stale
+        self._stale = set()
+        pending = [self._base]
+        while pending:
+            root = pending.pop()
+            try:
+                mtime = os.stat(root).st_mtime_ns
+            except OSError:
+                self._drop(root)
+                continue
 
-                res[vfspath.sys2vfs(vfs_root, filename)] = size
-                self.used += size
-        return res
+            listing = self._dirs.get(root)
+            if listing is None or listing.mtime != mtime or root in stale:
+                self._list(root, mtime)
+            pending.extend(os.path.join(root, name) for name in self._dirs[root].dirs)
+
+    def _invalidate(self, path: str):
+        with self._lock:
+            # Listing of the parent directory holds the entry, including renamed or removed directories
+            self._stale.add(os.path.dirname(path))
+
+    def get_files_info(self) -> typing.Dict[str, int]:
+        with self._lock:
+            self._sync()
+            return dict(self._index)
 
     def open(self, path: str, mode="rb"):
-        path = self._map(path)
+        readonly = mode in {"r", "rb", "rt"}
+        path = self._map_read(path) if readonly else self._map_write(path)
+
         try:
-            return open(path, mode)
+            file = open(path, mode)
         except FileNotFoundError:
             raise FileNotExistsError()
         except PermissionError:
@@ -61,8 +189,23 @@ class MappedFilesystem(Filesystem):
         except OSError as e:
             raise GyverHubError(e.strerror)
 
+        if readonly:
+            return file
+        # Size is known only when the data is written
+        return _WriteHandle(file, functools.partial(self._invalidate, path))
+
+    def real_path(self, path: str) -> str:
+        return self._map_read(path)
+
+    def invalidate(self, path: str):
+        self._invalidate(self._map_read(path))
+
+    def open_upload(self, path: str) -> AtomicFileUpload:
+        path = self._map_write(path)
+        return AtomicFileUpload(path, functools.partial(self._invalidate, path))
+
     def delete(self, path: str):
-        path = self._map(path)
+        path = self._map_read(path)
         try:
             os.remove(path)
         except FileNotFoundError:
@@ -71,10 +214,11 @@ class MappedFilesystem(Filesystem):
             raise FilePermissionsError()
         except OSError as e:
             raise GyverHubError(e.strerror)
+        self._invalidate(path)
 
     def rename(self, path: str, new_path: str):
-        path = self._map(path)
-        new_path = self._map(new_path)
+        path = self._map_read(path)
+        new_path = self._map_write(new_path)
         if path != new_path:
             try:
                 os.rename(path, new_path)
@@ -84,9 +228,14 @@ class MappedFilesystem(Filesystem):
                 raise FilePermissionsError()
             except OSError as e:
                 raise GyverHubError(e.strerror)
+            self._invalidate(path)
+            self._invalidate(new_path)
 
     def format(self):
-        self.used = 0
+        with self._lock:
+            self.used = 0
+            self._index.clear()
+            self._dirs.clear()
         try:
             rmtree_exc(self._base)
         except FileNotFoundError:
@@ -1,7 +1,7 @@
 import os
 import typing
 
-from . import Filesystem, vfspath
+from . import Filesystem, vfspath, AtomicFileUpload
 from .. import FileNotExistsError, FilePermissionsError, GyverHubError
 
 __all__ = ['MappedFile']
@@ -45,6 +45,23 @@ class MappedFile(Filesystem):
         except OSError as e:
             raise GyverHubError(e.strerror)
 
+    def real_path(self, path: str) -> str:
+        path = vfspath.normpath(path)
+        if path != '/':
+            raise FileNotExistsError()
+
+        return self._path
+
+    def can_delete(self, path: str) -> bool:
+        return self.writable and self._allow_delete
+
+    def open_upload(self, path: str) -> AtomicFileUpload:
+        path = vfspath.normpath(path)
+        if path != '/':
+            raise FileNotExistsError()
+
+        return AtomicFileUpload(self._path)
+
     def delete(self, path: str):
         path = vfspath.normpath(path)
         if path != '/':
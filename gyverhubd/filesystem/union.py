@@ -1,22 +1,42 @@
+import errno
+import functools
 import io
+import os
 import typing
 
-from . import vfspath, VirtualFile, Filesystem, MappedFile
-from .. import FileNotExistsError
+from . import vfspath, VirtualFile, Filesystem, MappedFile, FileUpload, AtomicFileUpload, call_io
+from .. import FileNotExistsError, FilePermissionsError, GyverHubError
 
 __all__ = ['UnionFilesystem']
 
 
-class UnionFilesystem(Filesystem):
-    __slots__ = ('_maps', )
+class _Node:
+    __slots__ = ('children', 'fs')
 
     def __init__(self):
+        self.children: typing.Dict[str, _Node] = {}
+        self.fs: typing.Optional[Filesystem] = None
+
+
+class UnionFilesystem(Filesystem):
+    __slots__ = ('_maps', '_root', '_get_fs')
+
+    def __init__(self, *, cache_size=256):
         super().__init__()
         self._maps: typing.Dict[str, Filesystem] = {}
+        self._root = _Node()
+        self._get_fs = functools.lru_cache(maxsize=cache_size)(self._resolve)
 
     def add(self, prefix: str, fs: Filesystem) -> 'UnionFilesystem':
         prefix = vfspath.normpath(prefix)
         self._maps[prefix] = fs
+
+        node = self._root
+        for comp in vfspath.split_all(prefix):
+            node = node.children.setdefault(comp, _Node())
+        node.fs = fs
+
+        self._get_fs.cache_clear()
         return self
 
     def virtual_file(self, path, size=0, used=0) -> typing.Callable[[typing.Callable[[], bytes]], VirtualFile]:
@@ -32,15 +52,83 @@ class UnionFilesystem(Filesystem):
 
     # ======== #
 
-    def _get_fs(self, path: str) -> typing.Tuple[Filesystem, str]:
-        path = vfspath.split_all(path)
-        for i in range(len(path), -1, -1):
-            prefix = vfspath.join_all(*path[:i])
-            fs = self._maps.get(prefix)
-            if fs is not None:
-                return fs, vfspath.join_all(*path[i:])
+    def _resolve(self, path: str) -> typing.Tuple[Filesystem, str]:
+        """
+        Finds filesystem mounted at the longest prefix of path. Results are cached by _get_fs
+        """
+        comps = vfspath.split_all(path)
+        node = self._root
+        fs, depth = node.fs, 0
+
+        for i, comp in enumerate(comps):
+            node = node.children.get(comp)
+            if node is None:
+                break
+            if node.fs is not None:
+                fs, depth = node.fs, i + 1
+
+        if fs is None:
+            raise FileNotExistsError()
+        return fs, vfspath.join_all(*comps[depth:])
+
+    @property
+    def blocking(self):
+        return any((fs.blocking for fs in self._maps.values()))
+
+    def is_blocking(self, path: str) -> bool:
+        fs, path = self._get_fs(path)
+        return fs.is_blocking(path)
+
+    # Each mount runs its operations where its own blocking flag says, so thread-unsafe filesystems are never
+    # accessed from the I/O threads
 
-        raise FileNotExistsError()
+    async def aget_files_info(self) -> typing.Dict[str, int]:
+        res = {}
+        for prefix, fs in self._maps.items():
+            for name, size in (await fs.aget_files_info()).items():
+                res[vfspath.join(prefix, name)] = size
+
+        return res
+
+    async def aformat(self):
+        for fs in self._maps.values():
+            await fs.aformat()
+
+    async def arename(self, path: str, new_path: str):
+        fs, sub_path = self._get_fs(path)
+        fs2, sub_new_path = self._get_fs(new_path)
+        if fs is fs2:
+            await fs.arename(sub_path, sub_new_path)
+            return
+
+        blocking, blocking2 = fs.is_blocking(sub_path), fs2.is_blocking(sub_new_path)
+        if blocking == blocking2:
+            await call_io(blocking, self.rename, path, new_path)
+            return
+
+        upload = await fs2.aopen_upload(sub_new_path)
+        try:
+            file = await fs.aopen(sub_path, "rb")
+            try:
+                expected = 0
+                while True:
+                    chunk = await call_io(blocking, file.read, self.chunk_size)
+                    if not chunk:
+                        break
+                    expected += len(chunk)
+                    await call_io(blocking2, upload.write, chunk)
+            finally:
+                await call_io(blocking, file.close)
+
+            if upload.size != expected:
+                raise GyverHubError("File copy failed")
+        except BaseException:
+            await call_io(blocking2, upload.abort)
+            raise
+
+        await call_io(blocking2, upload.commit)
+        # Remove source only when destination is completely written
+        await fs.adelete(sub_path)
 
     @property
     def used(self):
@@ -74,6 +162,22 @@ class UnionFilesystem(Filesystem):
         fs, path = self._get_fs(path)
         return fs.open(path, mode)
 
+    def real_path(self, path: str) -> typing.Optional[str]:
+        fs, path = self._get_fs(path)
+        return fs.real_path(path)
+
+    def invalidate(self, path: str):
+        fs, path = self._get_fs(path)
+        fs.invalidate(path)
+
+    def can_delete(self, path: str) -> bool:
+        fs, path = self._get_fs(path)
+        return fs.can_delete(path)
+
+    def open_upload(self, path: str) -> FileUpload:
+        fs, path = self._get_fs(path)
+        return fs.open_upload(path)
+
     def delete(self, path: str):
         fs, path = self._get_fs(path)
         fs.delete(path)
@@ -83,10 +187,58 @@ class UnionFilesystem(Filesystem):
         fs2, new_path = self._get_fs(new_path)
         if fs is fs2:
             fs.rename(path, new_path)
-        else:
-            data = fs.get_contents(path)
-            fs2.put_contents(new_path, data)
-            fs.delete(path)
+            return
+
+        src, dst = fs.real_path(path), fs2.real_path(new_path)
+        # Moving bypasses delete(), so it is allowed only where source filesystem permits deletion
+        if src is not None and dst is not None and fs.can_delete(path) and self._move_local(src, dst):
+            fs.invalidate(path)
+            fs2.invalidate(new_path)
+            return
+
+        with fs2.open_upload(new_path) as upload:
+            if src is not None and isinstance(upload, AtomicFileUpload):
+                upload.copy_from(src)
+                expected = os.path.getsize(src)
+            else:
+                expected = self._copy_stream(fs, path, upload)
+
+            if upload.size != expected:
+                raise GyverHubError("File copy failed")
+
+        # Remove source only when destination is completely written
+        fs.delete(path)
+
+    @staticmethod
+    def _move_local(src: str, dst: str) -> bool:
+        """
+        Renames file on the local disk. Returns False if files are on different devices
+        """
+        try:
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            os.replace(src, dst)
+        except FileNotFoundError:
+            raise FileNotExistsError()
+        except PermissionError:
+            raise FilePermissionsError()
+        except OSError as e:
+            if e.errno == errno.EXDEV:
+                return False
+            raise GyverHubError(e.strerror)
+        return True
+
+    def _copy_stream(self, fs: Filesystem, path: str, upload: FileUpload) -> int:
+        with fs.open(path, "rb") as f:
+            size = f.seek(0, io.SEEK_END)
+            f.seek(0)
+
+            while True:
+                chunk = f.read(self.chunk_size)
+                if not chunk:
+                    break
+                upload.write(chunk)
+
+        return size
 
     def format(self):
         for fs in self._maps.values():
@@ -0,0 +1,140 @@
+import os
+import shutil
+import tempfile
+import typing
+
+from .. import FileNotExistsError, FilePermissionsError, GyverHubError
+
+__all__ = ['FileUpload', 'SpooledUpload', 'AtomicFileUpload']
+
+UPLOAD_SUFFIX = '.upload'
+
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+class FileUpload:
+    """
+    Writable file that replaces the target file only after commit()
+    """
+    __slots__ = ('size', )
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        raise NotImplementedError()
+
+    def commit(self):
+        raise NotImplementedError()
+
+    def abort(self):
+        raise NotImplementedError()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+
+class SpooledUpload(FileUpload):
+    """
+    Upload for filesystems without streaming write support. Data is spooled to a temporary file and passed to
+    put_contents() on commit
+    """
+    __slots__ = ('_fs', '_path', '_file')
+
+    def __init__(self, fs, path: str, max_size: int = 1024 * 1024):
+        super().__init__()
+        self._fs = fs
+        self._path = path
+        self._file = tempfile.SpooledTemporaryFile(max_size)
+
+    def write(self, data: bytes) -> int:
+        self.size += len(data)
+        return self._file.write(data)
+
+    def commit(self):
+        try:
+            self._file.seek(0)
+            self._fs.put_contents(self._path, self._file.read())
+        finally:
+            self._file.close()
+
+    def abort(self):
+        self._file.close()
+
+
+class AtomicFileUpload(FileUpload):
+    """
+    Upload to the real file. Data is written to a temporary file in the same directory, which is atomically
+    renamed on commit
+    """
+    __slots__ = ('path', '_tmp', '_file', '_on_commit')
+
+    def __init__(self, path: str, on_commit: typing.Optional[typing.Callable[[], None]] = None):
+        super().__init__()
+        self.path = path
+        self._on_commit = on_commit
+
+        try:
+            fd, self._tmp = tempfile.mkstemp(UPLOAD_SUFFIX, f".{os.path.basename(path)}.", os.path.dirname(path))
+        except FileNotFoundError:
+            raise FileNotExistsError()
+        except PermissionError:
+            raise FilePermissionsError()
+        except OSError as e:
+            raise GyverHubError(e.strerror)
+
+        self._file: typing.BinaryIO = os.fdopen(fd, 'wb')
+        try:
+            os.chmod(self._tmp, 0o666 & ~_UMASK)
+        except OSError:
+            pass
+
+    def write(self, data: bytes) -> int:
+        self.size += len(data)
+        try:
+            return self._file.write(data)
+        except OSError as e:
+            raise GyverHubError(e.strerror)
+
+    def copy_from(self, path: str):
+        """
+        Fills upload with contents of the local file, using OS-level copy when available
+        """
+        try:
+            self._file.close()
+            shutil.copyfile(path, self._tmp)
+            self.size = os.path.getsize(self._tmp)
+        except FileNotFoundError:
+            raise FileNotExistsError()
+        except PermissionError:
+            raise FilePermissionsError()
+        except OSError as e:
+            raise GyverHubError(e.strerror)
+
+    def commit(self):
+        try:
+            self._file.close()
+            os.replace(self._tmp, self.path)
+        except PermissionError:
+            self.abort()
+            raise FilePermissionsError()
+        except OSError as e:
+            self.abort()
+            raise GyverHubError(e.strerror)
+
+        if self._on_commit is not None:
+            self._on_commit()
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.remove(self._tmp)
+        except OSError:
+            pass
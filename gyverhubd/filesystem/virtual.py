@@ -1,50 +1,123 @@
+import collections
+import heapq
+import time
 import typing
 
 from . import vfspath, Filesystem
-from .. import FileNotExistsError
+from .. import FileNotExistsError, NotEnoughSpaceError
 
 __all__ = ['VirtualFilesystem']
 
+_EVICTION_POLICIES = frozenset(('lru', 'ttl'))
+
 
 class VirtualFilesystem(Filesystem):
-    __slots__ = ('size', '_data')
+    """
+    In-memory filesystem. With size set, writes are limited to it; an eviction policy makes it drop old
+    files instead of failing: 'lru' removes the least recently used ones, 'ttl' expires files after ttl seconds
+    and removes the oldest ones when full
+    """
+    __slots__ = ('size', 'eviction', 'ttl', '_data', '_times', '_expiry', '_used')
+    blocking = False
 
-    def __init__(self, *, size=0):
+    def __init__(self, *, size=0, eviction: typing.Optional[str] = None, ttl: typing.Optional[float] = None):
         super().__init__()
+        if eviction is not None and eviction not in _EVICTION_POLICIES:
+            raise ValueError(f"Invalid eviction policy {eviction!r}")
+        if eviction == 'ttl' and ttl is None:
+            raise ValueError("ttl is required for 'ttl' eviction policy")
+
         self.size = size
-        self._data = {}
+        self.eviction = eviction
+        self.ttl = ttl
+        self._data: typing.OrderedDict[str, bytes] = collections.OrderedDict()
+        self._times: typing.Dict[str, float] = {}
+        # Heap of (write time, path), entries of overwritten or removed files are skipped when popped
+        self._expiry: typing.List[typing.Tuple[float, str]] = []
+        self._used = 0
 
     @property
     def used(self):
-        return sum((len(data) for data in self._data.values()))
+        self._expire()
+        return self._used
 
     def get_files_info(self) -> typing.Dict[str, int]:
+        self._expire()
         return {name: len(data) for name, data in self._data.items()}
 
     def get_contents(self, path: str) -> bytes:
         path = vfspath.normpath(path)
+        self._expire()
         if path not in self._data:
             raise FileNotExistsError()
+        if self.eviction == 'lru':
+            self._data.move_to_end(path)
         return self._data[path]
 
     def put_contents(self, path: str, data: bytes):
         path = vfspath.normpath(path)
+        self._expire()
+
+        old = self._data.get(path)
+        needed = len(data) - (0 if old is None else len(old))
+        if self.size and self._used + needed > self.size:
+            if self.eviction is None or len(data) > self.size:
+                raise NotEnoughSpaceError()
+
+            for name in tuple(self._data):
+                if self._used + needed <= self.size:
+                    break
+                if name != path:
+                    self._remove(name)
+
+        if old is not None:
+            self._remove(path)
         self._data[path] = data
+        self._set_time(path, time.monotonic())
+        self._used += len(data)
 
     def delete(self, path: str):
         path = vfspath.normpath(path)
+        self._expire()
         if path not in self._data:
             raise FileNotExistsError()
-        del self._data[path]
+        self._remove(path)
 
     def rename(self, path: str, new_path: str):
         path = vfspath.normpath(path)
         new_path = vfspath.normpath(new_path)
+        self._expire()
         if path not in self._data:
             raise FileNotExistsError()
         if path != new_path:
-            self._data[new_path] = self._data[path]
-            del self._data[path]
+            if new_path in self._data:
+                self._remove(new_path)
+            self._set_time(new_path, self._times.pop(path))
+            self._data[new_path] = self._data.pop(path)
 
     def format(self):
-        self._data = {}
+        self._data = collections.OrderedDict()
+        self._times = {}
+        self._expiry = []
+        self._used = 0
+
+    # internal
+
+    def _set_time(self, path: str, value: float):
+        self._times[path] = value
+        if self.ttl is not None:
+            heapq.heappush(self._expiry, (value, path))
+
+    def _remove(self, path: str):
+        self._used -= len(self._data.pop(path))
+        del self._times[path]
+
+    def _expire(self):
+        if self.ttl is None:
+            return
+
+        deadline = time.monotonic() - self.ttl
+        while self._expiry and self._expiry[0][0] <= deadline:
+            written, name = heapq.heappop(self._expiry)
+            if self._times.get(name) == written:
+                self._remove(name)
@@ -1,6 +1,6 @@
 import typing
 
-from . import Filesystem, vfspath
+from . import Filesystem, vfspath, FileUpload
 from .. import FileNotExistsError, FilePermissionsError, device
 
 __all__ = ['VirtualFile']
@@ -8,6 +8,7 @@ __all__ = ['VirtualFile']
 
 class VirtualFile(Filesystem):
     __slots__ = ('fget', 'fset', 'fdel', 'size', 'used')
+    blocking = False  # user callbacks are called on the event loop
 
     def __init__(self, fget=None, fset=None, fdel=None, *, size=0, used=0):
         super().__init__()
@@ -55,6 +56,17 @@ class VirtualFile(Filesystem):
             raise FilePermissionsError()
         self.fset(device, data)
 
+    def open_upload(self, path: str) -> FileUpload:
+        path = vfspath.normpath(path)
+        if path != '/':
+            raise FileNotExistsError()
+        if self.fset is None:
+            raise FilePermissionsError()
+        return super().open_upload(path)
+
+    def can_delete(self, path: str) -> bool:
+        return self.writable and self.fdel is not None
+
     def delete(self, path: str):
         path = vfspath.normpath(path)
         if path != '/':
@@ -0,0 +1,58 @@
+import shutil
+import tempfile
+import typing
+
+from . import GyverHubError, run_io
+
+__all__ = ["OtaUpdate", "OtaUpdateError"]
+
+
+class OtaUpdateError(GyverHubError):
+    message = "Update failed"
+
+
+class OtaUpdate:
+    """
+    Update image received in chunks. Data is spilled to a temporary file as it arrives
+    """
+    __slots__ = ('part', 'size', 'max_size', '_file')
+
+    def __init__(self, part: str, max_size: typing.Optional[int] = None):
+        self.part = part
+        self.size = 0
+        self.max_size = max_size
+        self._file = tempfile.TemporaryFile()
+
+    def write(self, data: bytes) -> int:
+        if self.max_size is not None and self.size + len(data) > self.max_size:
+            raise OtaUpdateError("Update is too large")
+
+        self.size += len(data)
+        return self._file.write(data)
+
+    async def awrite(self, data: bytes) -> int:
+        return await run_io(self.write, data)
+
+    @property
+    def file(self) -> typing.BinaryIO:
+        self._file.seek(0)
+        return self._file
+
+    def read(self) -> bytes:
+        return self.file.read()
+
+    def save(self, path: str):
+        with open(path, 'wb') as f:
+            shutil.copyfileobj(self.file, f)
+
+    async def asave(self, path: str):
+        await run_io(self.save, path)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
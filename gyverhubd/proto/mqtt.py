@@ -1,5 +1,4 @@
 import asyncio
-import json
 import os
 import ssl
 import sys
@@ -8,7 +7,7 @@ import socket
 
 import aiomqtt
 
-from . import Protocol, Request
+from . import Protocol, Request, Frame
 
 __all__ = ["MqttProtocol", "protocol_factory"]
 
@@ -130,8 +129,7 @@ class MqttRequest(Request):
     async def respond(self, data: dict):
         if self.did is not None:
             data['id'] = self.did
-        data = '\n' + json.dumps(data) + '\n'
-        await self.protocol.send_to(self, data)
+        await self.protocol.send_to(self, Frame(data))
 
     def set_focused(self, value: bool):
         pass
@@ -153,7 +151,7 @@ class MqttProtocol(Protocol):
         self._client: typing.Optional[aiomqtt.Client] = None
         self._server = None
         self._stopped = False
-        self._prefixes = []
+        self._prefixes: typing.Dict[str, int] = {}
 
     @property
     def focused(self) -> bool:
@@ -164,24 +162,42 @@ class MqttProtocol(Protocol):
         self._prefixes.clear()
         server.add_event_listener('start', self.__server_start)
         server.add_event_listener('stop', self.__server_stop)
+        server.add_event_listener('device.add', self.__device_add)
+        server.add_event_listener('device.remove', self.__device_remove)
 
     async def __server_start(self):
         self._client = aiomqtt.Client(**self._client_kwargs)
         await self._client.connect()
+        self._stopped = False
         asyncio.ensure_future(self._messages())
 
         for dev in self._server.devices:
+            await self.__device_add(dev)
+
+    async def __device_add(self, dev):
+        if dev.prefix not in self._prefixes:
+            self._prefixes[dev.prefix] = 0
             await self._client.subscribe(dev.prefix)
-            await self._client.subscribe(f"{dev.prefix}/{dev.id}/#")
-            await self._client.publish(f"{dev.prefix}/hub/{dev.id}/status", b'online')
-            self._prefixes.append(dev.prefix)
+        self._prefixes[dev.prefix] += 1
+
+        await self._client.subscribe(f"{dev.prefix}/{dev.id}/#")
+        await self._client.publish(f"{dev.prefix}/hub/{dev.id}/status", b'online')
+
+    async def __device_remove(self, dev):
+        await self._client.publish(f"{dev.prefix}/hub/{dev.id}/status", b'offline')
+        await self._client.unsubscribe(f"{dev.prefix}/{dev.id}/#")
+
+        self._prefixes[dev.prefix] -= 1
+        if not self._prefixes[dev.prefix]:
+            del self._prefixes[dev.prefix]
+            await self._client.unsubscribe(dev.prefix)
 
     async def _messages(self):
         async with self._client.messages() as messages:
             try:
                 async for message in messages:
                     req = MqttRequest(self, message)
-                    asyncio.ensure_future(self._server.dispatch_event('request', req))
+                    await self._server.submit(req)
             except aiomqtt.MqttError as e:
                 if not self._stopped:
                     raise e
@@ -191,18 +207,18 @@ class MqttProtocol(Protocol):
             await self._client.publish(f"{dev.prefix}/hub/{dev.id}/status", b'offline')
 
         self._stopped = True
+        self._prefixes.clear()
         await self._client.disconnect()
 
-    async def send(self, data: dict):
-        data = '\n' + json.dumps(data) + '\n'
-        for prefix in self._prefixes:
-            await self._client.publish(f"{prefix}/hub", data)
+    async def send(self, frame: Frame, broadcast=False):
+        for prefix in tuple(self._prefixes):
+            await self._client.publish(f"{prefix}/hub", frame.bytes)
 
-    async def send_to(self, req: MqttRequest, data: str):
+    async def send_to(self, req: MqttRequest, frame: Frame):
         if req.did is None:
-            await self._client.publish(f"{req.prefix}/hub", data)
+            await self._client.publish(f"{req.prefix}/hub", frame.bytes)
         else:
-            await self._client.publish(f"{req.prefix}/hub/{req.clid}/{req.did}", data)
+            await self._client.publish(f"{req.prefix}/hub/{req.clid}/{req.did}", frame.bytes)
 
 
 protocol_factory = MqttProtocol
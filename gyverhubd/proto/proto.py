@@ -1,8 +1,33 @@
 import typing
 
-from gyverhubd import parse_url
+from gyverhubd import parse_url, codec
 
-__all__ = ["Protocol", "Request"]
+__all__ = ["Protocol", "Request", "Frame"]
+
+
+class Frame:
+    """
+    Outgoing message, serialized at most once and shared between all protocols and clients. prefix is the prefix
+    of the sending device, if known
+    """
+    __slots__ = ('data', 'prefix', '_text', '_bytes')
+
+    def __init__(self, data: dict, prefix: typing.Optional[str] = None):
+        self.data = data
+        self.prefix = prefix
+        self._text = self._bytes = None
+
+    @property
+    def bytes(self) -> bytes:
+        if self._bytes is None:
+            self._bytes = codec.encode_frame(self.data)
+        return self._bytes
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = self.bytes.decode()
+        return self._text
 
 
 class Protocol:
@@ -11,7 +36,7 @@ class Protocol:
     def bind(self, server):
         raise NotImplementedError()
 
-    async def send(self, data: dict):
+    async def send(self, frame: Frame, broadcast=False):
         raise NotImplementedError()
 
 
@@ -28,6 +53,10 @@ class Request:
         self.prefix, self.clid, self.did, self.cmd, self.name = parse_url(url)
         self.value = value
 
+    @property
+    def client(self) -> typing.Hashable:
+        return self.protocol, self.clid
+
     async def respond(self, data: dict):
         raise NotImplementedError()
 
@@ -1,11 +1,10 @@
 import asyncio
-import json
 import sys
 import typing
 
 import serial_asyncio
 
-from . import Protocol, Request
+from . import Protocol, Request, Frame
 
 __all__ = ["SerialProtocol", "protocol_factory"]
 
@@ -74,7 +73,7 @@ class SerialRequest(Request):
     async def respond(self, data: dict):
         if self.did is not None:
             data['id'] = self.did
-        await self.protocol.send(data)
+        await self.protocol.send(Frame(data))
 
     def set_focused(self, value: bool):
         self.protocol.focused = value
@@ -101,14 +100,13 @@ class SerialProtocol(Protocol):
             data = await self._reader.readuntil(b'\x00')
             data = data.decode()
             req = SerialRequest(self, data)
-            asyncio.ensure_future(self._server.dispatch_event('request', req))
+            await self._server.submit(req)
 
     async def __server_stop(self):
         self._writer.close()
 
-    async def send(self, data: dict):
-        data = '\n' + json.dumps(data) + '\n'
-        self._writer.write(data.encode())
+    async def send(self, frame: Frame, broadcast=False):
+        self._writer.write(frame.bytes)
 
 
 protocol_factory = SerialProtocol
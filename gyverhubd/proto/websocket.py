@@ -1,20 +1,24 @@
 import asyncio
-import json
+import collections
+import io
+import mimetypes
+import os
 import ssl
 import sys
 import typing
 
-from aiohttp import web
+from aiohttp import web, BodyPartReader
 from websockets import server as ws_server
 from websockets.exceptions import ConnectionClosed
 
-from . import Protocol, Request
-from .. import __version__, FileNotExistsError, FilePermissionsError, GyverHubError
+from . import Protocol, Request, Frame
+from .. import __version__, FileNotExistsError, FilePermissionsError, GyverHubError, codec, call_io
 
 __all__ = ["WebsocketProtocol", "protocol_factory"]
 HUB_SP = ws_server.Subprotocol("hub")
 SERVER_NAME = f"Python/{sys.version.partition(' ')[0]} gyverhubd/{__version__}"
-_FOCUSED_PROP = f'__focused'
+_HTTP_CHUNK_SIZE = 64 * 1024
+_OVERFLOW_POLICIES = frozenset(('drop', 'merge', 'disconnect'))
 
 _HELP = """\
 List of WebSocket protocol options:
@@ -24,6 +28,11 @@ open_timeout      float Timeout for opening webbsocket connections in seconds.
 ping_interval     float Delay between keepalive pings in seconds.
 ping_timeout      float Timeout for keepalive pings in seconds.
 close_timeout     float Timeout for closing the connection in seconds. For legacy reasons, the actual timeout is larger.
+send-queue        int   Maximum number of outgoing messages queued for one client, default is 64.
+send-overflow     str   What to do when client queue is full. Must be one of: drop (drop oldest update), merge (merge
+                        update into queued one, default) or disconnect (close connection to the slow client).
+update-interval   float Minimal delay between update messages sent to one client in seconds. Updates sent during
+                        the delay are merged into one message. Disabled by default.
 
 For http connections
 backlog           int   Number of unaccepted connections that the system will allow before refusing new connections.
@@ -32,6 +41,7 @@ http-upload       bool  Enable file uploading via HTTP POST.
 http-ota          bool  Enable OTA package uploading via HTTP POST.
 http-download     bool  Enable file downloading via HTTP GET.
 http-download-dir str   Base directory for downloading files via HTTP.
+http-max-body     int   Maximum size of file uploaded via HTTP POST in bytes. Unlimited by default.
 tls                     Enable SSL/TLS secure server with specified parameters. List of comma-separated items,
                         in format NAME:VALUE. Name can be one of:
   certfile        str   PEM-encoded server certificate.
@@ -52,9 +62,23 @@ def _parse_options(options: typing.Dict[str, str]) -> dict:
         elif option in {'open_timeout', 'ping_interval', 'ping_timeout', 'close_timeout', 'shutdown_timeout'}:
             res[option.replace('-', '_')] = float(value)
 
+        elif option == 'send-queue':
+            res['send_queue'] = int(value)
+
+        elif option == 'send-overflow':
+            if value not in _OVERFLOW_POLICIES:
+                raise ValueError(f"Invalid websocket option ({option}) value: {value!r}")
+            res['send_overflow'] = value
+
+        elif option == 'update-interval':
+            res['update_interval'] = float(value)
+
         elif option == 'http-download-dir':
             res['http_download_dir'] = value
 
+        elif option == 'http-max-body':
+            res['http_max_body'] = int(value)
+
         elif option in {'http-upload', 'http-download', 'http-ota'}:
             value = value.lower()
             if value in {'yes', 'on', 'true'}:
@@ -80,23 +104,157 @@ def _parse_options(options: typing.Dict[str, str]) -> dict:
     return res
 
 
+class _Client:
+    __slots__ = ('ws', 'focused', '_queue', '_limit', '_overflow', '_interval', '_updates', '_next_update', '_timer',
+                 '_ready', '_overflowed', '_writer')
+
+    def __init__(self, ws: ws_server.WebSocketServerProtocol, limit: int, overflow: str, update_interval: float = 0):
+        self.ws = ws
+        self.focused: typing.Set[typing.Tuple[str, str]] = set()
+        self._queue: typing.Deque[Frame] = collections.deque()
+        self._limit = limit
+        self._overflow = overflow
+        self._interval = update_interval
+        # Updates waiting for the next interval, merged per device
+        self._updates: typing.Dict[str, dict] = {}
+        self._next_update = 0.0
+        self._timer: typing.Optional[asyncio.TimerHandle] = None
+        self._ready = asyncio.Event()
+        self._overflowed = False
+        self._writer = asyncio.create_task(self._write())
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue) + len(self._updates)
+
+    def put(self, frame: Frame):
+        if self._interval:
+            typ, did = frame.data.get('type'), frame.data.get('id')
+            if typ == 'update':
+                self._updates[did] = {**self._updates.get(did, {}), **frame.data['updates']}
+                self._ready.set()
+                return
+
+            if typ == 'ui' and did in self._updates:
+                # Keep order of updates and ui frame carrying newer values
+                self._enqueue(Frame(dict(type='update', id=did, updates=self._updates.pop(did))))
+
+        self._enqueue(frame)
+
+    def close(self):
+        self._writer.cancel()
+        if self._timer is not None:
+            self._timer.cancel()
+
+    def _enqueue(self, frame: Frame):
+        if len(self._queue) >= self._limit:
+            if self._overflow == 'disconnect':
+                self._disconnect()
+                return
+
+            if self._overflow == 'merge' and self._merge(frame):
+                return
+
+            if not self._drop():
+                # Responses cannot be dropped without breaking the client state
+                if frame.data.get('type') != 'update':
+                    self._disconnect()
+                return
+
+        self._queue.append(frame)
+        self._ready.set()
+
+    def _disconnect(self):
+        self._overflowed = True
+        self._ready.set()
+
+    def _merge(self, frame: Frame) -> bool:
+        if frame.data.get('type') != 'update':
+            return False
+
+        did = frame.data.get('id')
+        for i, queued in enumerate(reversed(self._queue)):
+            if queued.data.get('id') != did:
+                continue
+            if queued.data.get('type') != 'update':
+                # Merged values would be applied before this frame (e.g. ui carrying older values)
+                return False
+
+            data = dict(queued.data)
+            data['updates'] = {**queued.data['updates'], **frame.data['updates']}
+            self._queue[-i - 1] = Frame(data)
+            return True
+
+        return False
+
+    def _drop(self) -> bool:
+        """
+        Drops the oldest queued update. Returns False if there is none
+        """
+        for i, queued in enumerate(self._queue):
+            if queued.data.get('type') == 'update':
+                del self._queue[i]
+                return True
+
+        return False
+
+    def _wakeup(self):
+        self._timer = None
+        self._ready.set()
+
+    async def _write(self):
+        try:
+            while True:
+                await self._ready.wait()
+                self._ready.clear()
+
+                if self._overflowed:
+                    await self.ws.close(1008, "Client is too slow")
+                    return
+
+                while self._queue:
+                    await self.ws.send(self._queue.popleft().text)
+
+                if self._updates:
+                    await self._write_updates()
+
+        except ConnectionClosed:
+            pass
+
+    async def _write_updates(self):
+        loop = asyncio.get_running_loop()
+        delay = self._next_update - loop.time()
+        if delay > 0:
+            if self._timer is None:
+                self._timer = loop.call_later(delay, self._wakeup)
+            return
+
+        self._next_update = loop.time() + self._interval
+        updates, self._updates = self._updates, {}
+        for did, values in updates.items():
+            await self.ws.send(Frame(dict(type='update', id=did, updates=values)).text)
+
+
 class WebsocketRequest(Request):
-    def __init__(self, protocol, ws, data):
+    def __init__(self, protocol, client: _Client, data):
         self.protocol: WebsocketProtocol = protocol
-        self._ws = ws
+        self._client = client
 
         assert isinstance(data, str) and data and data[-1] == '\0'
         url, eq, data = data[:-1].partition('=')
         super().__init__(url, data if eq else None)
 
+    @property
+    def client(self):
+        return self._client
+
     async def respond(self, data: dict):
         if self.did is not None:
             data['id'] = self.did
-        data = '\n' + json.dumps(data) + '\n'
-        await self._ws.send(data)
+        self._client.put(Frame(data))
 
     def set_focused(self, value: bool):
-        setattr(self._ws, _FOCUSED_PROP, value)
+        self.protocol._set_focused(self._client, self.prefix, self.did, value)
 
 
 class WebsocketProtocol(Protocol):
@@ -112,14 +270,33 @@ class WebsocketProtocol(Protocol):
         self._host = host
         self._port = port
 
-        self._clients = {}
+        self._clients: typing.Dict[typing.Any, _Client] = {}
+        self._focused: typing.Dict[typing.Tuple[str, str], typing.Set[_Client]] = {}
         self._server = None
         self._ws_srv = None
         self._http_srv = None
 
     @property
     def focused(self) -> bool:
-        return any((getattr(i, _FOCUSED_PROP, False) for i in self._clients.values()))
+        return bool(self._focused)
+
+    @property
+    def queue_depths(self) -> typing.Dict[typing.Any, int]:
+        return {addr: i.queue_depth for addr, i in self._clients.items()}
+
+    def _set_focused(self, client: _Client, prefix: str, did: str, value: bool):
+        key = (prefix, did)
+        if value:
+            client.focused.add(key)
+            self._focused.setdefault(key, set()).add(client)
+
+        else:
+            client.focused.discard(key)
+            clients = self._focused.get(key)
+            if clients is not None:
+                clients.discard(client)
+                if not clients:
+                    del self._focused[key]
 
     def bind(self, server):
         self._server = server
@@ -164,44 +341,83 @@ class WebsocketProtocol(Protocol):
     async def _config_handler(self, _):
         config = dict(upload=self._kwargs.get('http_upload', True), download=self._kwargs.get('http_download', True),
                       ota=self._kwargs.get('http_ota', True), path=self._kwargs.get('http_download_dir', '/'))
-        return web.Response(text=json.dumps(config))
+        return web.Response(body=codec.dumps(config), content_type='text/plain')
 
     async def _upload_handler(self, req: web.Request):
-        post = await req.post()
-        file = post.get('upload')
-        if file is None:
-            return web.Response(status=400, reason="Missing upload field")
-        if not isinstance(file, web.FileField):
-            return web.Response(status=400, reason="Upload field must be file")
+        file = await self._get_file_field(req, 'upload')
+        if isinstance(file, web.Response):
+            return file
 
-        name = file.filename
-        data = file.file.read()
-        await self._server.dispatch_event("request.upload", name, data)
+        try:
+            await self._server.dispatch_event("request.upload", file.filename, self._read_chunks(file))
+        except GyverHubError as e:
+            return web.Response(status=400, reason=e.message)
 
         return web.Response()
 
     async def _ota_handler(self, req: web.Request):
-        post = await req.post()
         part = req.query.get('type')
         if part is None:
             return web.Response(status=400, text='FAIL', reason="Missing part field")
 
-        file = post.get(part)
-        if file is None:
-            return web.Response(status=400, text='FAIL', reason="Missing upload field")
-        if not isinstance(file, web.FileField):
-            return web.Response(status=400, text='FAIL', reason="Upload field must be file")
+        file = await self._get_file_field(req, part)
+        if isinstance(file, web.Response):
+            return web.Response(status=file.status, text='FAIL', reason=file.reason)
 
-        data = file.file.read()
-        await self._server.dispatch_event("request.ota", part, data)
+        try:
+            await self._server.dispatch_event("request.ota", part, self._read_chunks(file))
+        except GyverHubError as e:
+            return web.Response(status=400, text='FAIL', reason=e.message)
 
         return web.Response(text='OK')
 
+    async def _get_file_field(self, req: web.Request, name: str) -> typing.Union[BodyPartReader, web.Response]:
+        limit = self._kwargs.get('http_max_body')
+        if limit is not None and req.content_length is not None and req.content_length > limit:
+            raise web.HTTPRequestEntityTooLarge(limit, req.content_length)
+
+        try:
+            reader = await req.multipart()
+        except (ValueError, AssertionError):
+            return web.Response(status=400, reason="Multipart body expected")
+
+        async for field in reader:
+            if field.name != name:
+                await field.release()
+                continue
+
+            if not isinstance(field, BodyPartReader) or field.filename is None:
+                return web.Response(status=400, reason="Upload field must be file")
+            return field
+
+        return web.Response(status=400, reason="Missing upload field")
+
+    async def _read_chunks(self, field: BodyPartReader) -> typing.AsyncIterator[bytes]:
+        limit = self._kwargs.get('http_max_body')
+        size = 0
+
+        while True:
+            chunk = await field.read_chunk(_HTTP_CHUNK_SIZE)
+            if not chunk:
+                break
+
+            size += len(chunk)
+            if limit is not None and size > limit:
+                raise web.HTTPRequestEntityTooLarge(limit, size)
+            yield chunk
+
     async def _fs_handler(self, req: web.Request):
         path = '/' + req.match_info['path']
 
         try:
-            data = await self._server.get_file_contents(path)
+            real_path = await self._server.get_file_path(path)
+            if real_path is not None:
+                if not os.path.isfile(real_path):
+                    return web.Response(status=404)
+                # sendfile, Range, ETag and Last-Modified are handled by aiohttp
+                return web.FileResponse(real_path, chunk_size=_HTTP_CHUNK_SIZE)
+
+            opened = await self._server.open_file(path)
         except FileNotExistsError:
             return web.Response(status=404)
         except FilePermissionsError:
@@ -209,13 +425,56 @@ class WebsocketProtocol(Protocol):
         except GyverHubError:
             return web.Response(status=400)
 
-        if data is None:
+        if opened is None:
             return web.Response(status=404)
 
-        return web.Response(body=data, status=404)
+        file, blocking = opened
+        with file:
+            return await self._stream_file(req, path, file, blocking)
+
+    @staticmethod
+    async def _stream_file(req: web.Request, path: str, file: typing.BinaryIO,
+                           blocking: bool) -> web.StreamResponse:
+        size = await call_io(blocking, file.seek, 0, io.SEEK_END)
+
+        try:
+            rng = req.http_range
+        except ValueError:
+            rng = slice(None)
+
+        res = web.StreamResponse()
+        res.headers['Accept-Ranges'] = 'bytes'
+        res.content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+        start, stop = 0, size
+        if rng.start is not None or rng.stop is not None:
+            start, stop, _ = rng.indices(size)
+            if start >= stop:
+                return web.Response(status=416, headers={'Content-Range': f'bytes */{size}'})
+
+            res.set_status(206)
+            res.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+
+        res.content_length = stop - start
+        await res.prepare(req)
+
+        await call_io(blocking, file.seek, start)
+        remaining = stop - start
+        while remaining > 0:
+            chunk = await call_io(blocking, file.read, min(_HTTP_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+
+            await res.write(chunk)
+            remaining -= len(chunk)
+
+        await res.write_eof()
+        return res
 
     async def _handle_ws(self, ws: ws_server.WebSocketServerProtocol):
-        self._clients[ws.remote_address] = ws
+        client = _Client(ws, self._kwargs.get('send_queue', 64), self._kwargs.get('send_overflow', 'merge'),
+                         self._kwargs.get('update_interval', 0))
+        self._clients[ws.remote_address] = client
 
         try:
             while not ws.closed:
@@ -224,16 +483,30 @@ class WebsocketProtocol(Protocol):
                 except ConnectionClosed:
                     pass
                 else:
-                    req = WebsocketRequest(self, ws, data)
-                    asyncio.ensure_future(self._server.dispatch_event('request', req))
+                    req = WebsocketRequest(self, client, data)
+                    await self._server.submit(req)
 
         finally:
+            client.close()
+            for prefix, did in tuple(client.focused):
+                self._set_focused(client, prefix, did, False)
             del self._clients[ws.remote_address]
 
-    async def send(self, data: dict):
-        data = '\n' + json.dumps(data) + '\n'
-        for i in tuple(self._clients.values()):
-            await i.send(data)
+    async def send(self, frame: Frame, broadcast=False):
+        did = frame.data.get('id')
+        if broadcast:
+            clients = self._clients.values()
+        elif frame.prefix is not None:
+            clients = self._focused.get((frame.prefix, did), ())
+        else:
+            # Sender is unknown, push to everyone focused on this id
+            clients = set()
+            for (_, i), focused in self._focused.items():
+                if i == did:
+                    clients |= focused
+
+        for i in clients:
+            i.put(frame)
 
 
 protocol_factory = WebsocketProtocol
@@ -1,24 +1,74 @@
 import asyncio
 import typing
 
-from . import Device, Protocol, Request, response, GyverHubError, EventTarget, context, load_protocol
+from . import Device, Protocol, Request, Frame, response, GyverHubError, EventTarget, context, load_protocol, \
+    Dispatcher, call_io
 
 __all__ = ["Server", "run_server_async", "run_server"]
 
 
 class Server(EventTarget):
-    def __init__(self, *devices: Device, protocols: typing.List[typing.Union[Protocol, dict]] = ()):
+    def __init__(self, *devices: Device, protocols: typing.List[typing.Union[Protocol, dict]] = (),
+                 dispatcher: typing.Optional[Dispatcher] = None):
         super().__init__()
         self._protocols: typing.List[Protocol] = []
-        self.devices = devices
+        self.dispatcher = Dispatcher() if dispatcher is None else dispatcher
+        self._devices: typing.List[Device] = []
+        self._routes: typing.Dict[typing.Tuple[str, str], Device] = {}
+        self._prefixes: typing.Dict[str, typing.List[Device]] = {}
         self._running: typing.Optional[asyncio.Future] = None
+        self._started = False
         self.add_event_listener('request', self._on_request)
         self.add_event_listener('request.upload', self._on_request_upload)
         self.add_event_listener('request.ota', self._on_request_ota)
+        self.dispatcher.bind(self)
+
+        for i in devices:
+            self._add_route(i)
 
         for i in protocols:
             self.add_protocol(i)
 
+    @property
+    def devices(self) -> typing.Tuple[Device, ...]:
+        return tuple(self._devices)
+
+    def get_device(self, prefix: str, did: str) -> typing.Optional[Device]:
+        return self._routes.get((prefix, did))
+
+    async def add_device(self, dev: Device):
+        self._add_route(dev)
+        if self._started:
+            with context.server_context(self):
+                await self.dispatch_event('device.add', dev)
+
+    async def remove_device(self, dev: Device):
+        self._remove_route(dev)
+        if self._started:
+            with context.server_context(self):
+                await self.dispatch_event('device.remove', dev)
+
+    def _add_route(self, dev: Device):
+        key = dev.prefix, dev.id
+        if key in self._routes:
+            raise ValueError(f"Device {dev.prefix}/{dev.id} is already registered")
+
+        self._routes[key] = dev
+        self._prefixes.setdefault(dev.prefix, []).append(dev)
+        self._devices.append(dev)
+
+    def _remove_route(self, dev: Device):
+        key = dev.prefix, dev.id
+        if self._routes.get(key) is not dev:
+            raise ValueError(f"Device {dev.prefix}/{dev.id} is not registered")
+
+        del self._routes[key]
+        self._devices.remove(dev)
+        devs = self._prefixes[dev.prefix]
+        devs.remove(dev)
+        if not devs:
+            del self._prefixes[dev.prefix]
+
     def add_protocol(self, proto: typing.Union[Protocol, dict]):
         if isinstance(proto, dict):
             name = proto.pop('name')
@@ -30,62 +80,96 @@ class Server(EventTarget):
     async def start(self):
         with context.server_context(self):
             await self.dispatch_event('start')
+        self._started = True
 
     async def stop(self):
         if self._running is not None:
             self._running.set_result(None)
             return
 
+        self._started = False
         with context.server_context(self):
             await self.dispatch_event('stop')
 
+    async def submit(self, req: Request) -> bool:
+        return await self.dispatcher.submit(req)
+
     async def _on_request(self, req: Request):
         with context.request_context(req), context.server_context(self):
             if req.cmd is None and req.did is None:
-                for dev in self.devices:
+                for dev in tuple(self._prefixes.get(req.prefix, ())):
                     with context.device_context(dev):
                         await dev.dispatch_event('discover')
 
                 return
 
-            for dev in self.devices:
-                if dev.prefix != req.prefix or dev.id != req.did:
-                    continue
+            dev = self._routes.get((req.prefix, req.did))
+            if dev is None:
+                return
 
-                with context.device_context(dev):
-                    if req.cmd is None:
-                        await dev.dispatch_event('discover')
-                    else:
-                        try:
-                            await dev.dispatch_event('request')
-                        except GyverHubError as e:
-                            await req.respond(response(e.type, text=e.message))
+            with context.device_context(dev):
+                if req.cmd is None:
+                    await dev.dispatch_event('discover')
+                else:
+                    try:
+                        await dev.dispatch_event('request')
+                    except GyverHubError as e:
+                        await req.respond(response(e.type, text=e.message))
+
+    async def _on_request_upload(self, name: str, chunks: typing.AsyncIterable[bytes]):
+        dev = self._devices[0]
+        with context.server_context(self), context.device_context(dev):
+            if dev.fs is None:
+                return
 
-                break
+            upload = await dev.fs.aopen_upload(name)
+            blocking = dev.fs.is_blocking(name)
+            try:
+                async for chunk in chunks:
+                    await call_io(blocking, upload.write, chunk)
+            except BaseException:
+                await call_io(blocking, upload.abort)
+                raise
 
-    async def _on_request_upload(self, name: str, data: bytes):
-        dev = self.devices[0]
-        with context.server_context(self), context.device_context(dev):
-            if dev.fs is not None:
-                dev.fs.put_contents(name, data)
+            await call_io(blocking, upload.commit)
 
-    async def _on_request_ota(self, part: str, data: bytes):
-        dev = self.devices[0]
+    async def _on_request_ota(self, part: str, chunks: typing.AsyncIterable[bytes]):
+        dev = self._devices[0]
         with context.server_context(self), context.device_context(dev):
             if part not in dev.ota_parts:
                 return
-            await dev.ota_update(part, data)
+
+            update = dev.ota_begin(part)
+            try:
+                async for chunk in chunks:
+                    await update.awrite(chunk)
+            except BaseException:
+                update.close()
+                raise
+
+            await dev.ota_finish(update)
 
     async def get_file_contents(self, path: str) -> typing.Optional[bytes]:
-        dev = self.devices[0]
+        dev = self._devices[0]
+        with context.server_context(self), context.device_context(dev):
+            if dev.fs is not None:
+                return await dev.fs.aget_contents(path)
+
+    async def get_file_path(self, path: str) -> typing.Optional[str]:
+        dev = self._devices[0]
+        with context.server_context(self), context.device_context(dev):
+            if dev.fs is not None:
+                return dev.fs.real_path(path)
+
+    async def open_file(self, path: str) -> typing.Optional[typing.Tuple[typing.BinaryIO, bool]]:
+        dev = self._devices[0]
         with context.server_context(self), context.device_context(dev):
             if dev.fs is not None:
-                return dev.fs.get_contents(path)
+                return await dev.fs.aopen(path, "rb"), dev.fs.is_blocking(path)
 
-    async def send(self, data, broadcast=False):
-        for i in self._protocols:
-            if broadcast or i.focused:
-                await i.send(data)
+    async def send(self, data: dict, broadcast=False, prefix: typing.Optional[str] = None):
+        frame = Frame(data, prefix)
+        await asyncio.gather(*(i.send(frame, broadcast) for i in self._protocols if broadcast or i.focused))
 
     async def run(self):
         if self._running is not None:
@@ -1,6 +1,8 @@
 import enum
 import typing
 
+from .. import codec
+
 __all__ = ["Component", "ChangeType"]
 
 
@@ -11,7 +13,7 @@ class ChangeType(enum.Enum):
 
 
 class Component:
-    __slots__ = ('__changed__', '__data__', '__handlers__', '__layout__', '__enabled__')
+    __slots__ = ('__changed__', '__data__', '__handlers__', '__layout__', '__enabled__', '__json__')
     __type__: str
     __fields__: typing.Tuple[typing.Tuple[str, str, typing.Any], ...] = ()
     __value_field__: typing.Optional[typing.Tuple[str, str, typing.Any]] = None
@@ -21,6 +23,7 @@ class Component:
     __handlers__: typing.List[callable]
     __layout__: 'Layout'
     __enabled__: bool
+    __json__: typing.Optional[codec.JsonFragment]
 
     def __init_subclass__(cls, **kwargs):
         fields = ()
@@ -40,6 +43,7 @@ class Component:
             name, json, default = type(self).__value_field__
             self.__data__[name] = kwargs.get(name, default)
         self.__handlers__ = []
+        self.__json__ = None
         self.__changed__ = ChangeType.FULL
         if 'disabled' in kwargs:
             self.__enabled__ = not kwargs.pop('disabled')
@@ -64,6 +68,15 @@ class Component:
         self.__changed__ = ChangeType.NO
         return res
 
+    def to_json_fragment(self) -> codec.JsonFragment:
+        """
+        to_json() result encoded once and cached until any field changes
+        """
+        if self.__json__ is None:
+            self.__json__ = codec.JsonFragment(self.to_json())
+        self.__changed__ = ChangeType.NO
+        return self.__json__
+
     def rebuild_required(self):
         return self.__changed__ == ChangeType.FULL
 
@@ -76,15 +89,28 @@ class Component:
     def __setattr__(self, key, value):
         if key == '__enabled__' and value != getattr(self, key, None):
             self.__changed__ = ChangeType.FULL
-        if key in {'__changed__', '__data__', '__handlers__', '__layout__', '__enabled__'}:
-            return super().__setattr__(key, value)
-        if self.__changed__ != ChangeType.FULL and value != getattr(self, key, None) and self.__enabled__:
-            if type(self).__value_field__ is not None and key == type(self).__value_field__[0]:
-                self.__changed__ = ChangeType.UPDATE
-            else:
-                self.__changed__ = ChangeType.FULL
+        if key in {'__changed__', '__data__', '__handlers__', '__layout__', '__enabled__', '__json__'}:
+            super().__setattr__(key, value)
+            if key == '__changed__' or key == '__layout__':
+                self.__track_change()
+            return
+        if value != getattr(self, key, None):
+            self.__json__ = None
+            if self.__changed__ != ChangeType.FULL and self.__enabled__:
+                if type(self).__value_field__ is not None and key == type(self).__value_field__[0]:
+                    self.__changed__ = ChangeType.UPDATE
+                else:
+                    self.__changed__ = ChangeType.FULL
         self.__data__[key] = value
 
+    def __track_change(self):
+        """
+        keeps component in the dirty set of its layout while it has unsent changes
+        """
+        mark = getattr(getattr(self, '__layout__', None), '_mark_changed', None)
+        if mark is not None:
+            mark(self, self.__changed__)
+
     def __getattr__(self, item):
         try:
             return self.__data__[item]
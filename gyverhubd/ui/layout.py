@@ -2,8 +2,8 @@ import contextlib
 import itertools
 import typing
 
-from . import DeviceUi, Component
-from .. import response
+from . import DeviceUi, Component, ChangeType
+from .. import response, codec
 
 __all__ = ["Layout"]
 
@@ -14,8 +14,20 @@ class Layout(DeviceUi):
             components = []
 
         self.components = components
+        # Components with unsent changes, in order of change (dict is used as ordered set)
+        self._dirty: typing.Dict[Component, None] = {}
+        self._by_name: typing.Dict[str, Component] = {i.name: i for i in components if i.name is not None}
+        self._watchers: typing.List[typing.Callable[[], None]] = []
+        # Changes to push to all clients. Kept apart from _dirty, which is consumed by responses to requests
+        self._pushes: typing.Dict[Component, ChangeType] = {}
+        # Controls of the last sent ui frame
+        self._sent: typing.Optional[typing.List[typing.Tuple[Component, codec.JsonFragment]]] = None
         self._new_name = (f"u{i}" for i in itertools.count())
 
+        for i in components:
+            # Registers pending changes of the component in _dirty
+            i.__layout__ = self
+
     def __new__(cls, components: typing.List[Component] = None):
         self = super().__new__(cls)
         if callable(components):
@@ -31,6 +43,7 @@ class Layout(DeviceUi):
             el: Component = item(*args, **kwargs)
             el.__set_name__(self, next(self._new_name))
             self.components.append(el)
+            self._by_name[el.name] = el
             return el
 
         return class_wrapper
@@ -59,12 +72,73 @@ class Layout(DeviceUi):
             for i in cs:
                 i.tab_w = tab_w
 
+    def watch(self, fn: typing.Callable[[], None]):
+        """
+        Calls fn whenever some component gets changes that were not sent yet
+        """
+        self._watchers.append(fn)
+
+    def collect_changes(self) -> dict:
+        """
+        Returns frame with changes made since the last sent one: ui, update or OK
+        """
+        if self._rebuild_required():
+            return self._rebuild()
+
+        updates = self._to_updates()
+
+        if self._rebuild_required():
+            return self._rebuild()
+
+        if updates is not None:
+            return response("update", updates=updates)
+
+        return response("OK")
+
+    def collect_pushes(self) -> typing.Optional[dict]:
+        """
+        Returns frame with all changes made since the previous call, even ones already sent in responses,
+        or None if there are none. Collected only while there are watchers
+        """
+        pushes, self._pushes = self._pushes, {}
+        if not pushes:
+            return None
+
+        # Changes are pushed to everyone, responses do not need them anymore
+        self._to_updates()
+        if ChangeType.FULL in pushes.values() or self._rebuild_required():
+            return response("ui", controls=self._to_json())
+
+        updates = {}
+        for i in pushes:
+            field = type(i).__value_field__
+            if i.__enabled__ and field is not None and field[1] is not None:
+                updates[i.name] = i.value2event(getattr(i, field[0]))
+
+        if not updates:
+            return None
+        return response("update", updates=updates)
+
+    def _mark_changed(self, component: Component, change: ChangeType):
+        if change == ChangeType.NO:
+            self._dirty.pop(component, None)
+            return
+
+        self._dirty[component] = None
+        if self._watchers:
+            notify = component not in self._pushes
+            if self._pushes.get(component) != ChangeType.FULL:
+                self._pushes[component] = change
+            if notify:
+                for i in self._watchers:
+                    i()
+
     def _rebuild_required(self):
-        return any((i.rebuild_required() for i in self.components))
+        return any((i.rebuild_required() for i in self._dirty))
 
     def _to_updates(self):
         updates = {}
-        for i in self.components:
+        for i in tuple(self._dirty):
             update = i.to_update()
             if update is not None:
                 updates[i.name] = update
@@ -74,35 +148,73 @@ class Layout(DeviceUi):
         return updates
 
     def _to_json(self):
-        components = []
+        sent = []
         for i in self.components:
-            data = i.to_json()
+            data = i.to_json_fragment()
             if i.__enabled__:
-                components.append(data)
-        return components
+                sent.append((i, data))
+        self._dirty.clear()
+        self._sent = sent
+        # Copies keep cache intact if the caller modifies the frame
+        return [data.copy() for i, data in sent]
+
+    def _rebuild(self) -> dict:
+        """
+        Sends full ui frame only if the control list structure has changed since the last one
+        """
+        sent = self._sent
+        controls = self._to_json()
+        updates = None if sent is None else _diff_controls(sent, self._sent)
+
+        if updates is None:
+            return response("ui", controls=controls)
+        if updates:
+            return response("update", updates=updates)
+        return response("OK")
 
     async def _on_event(self, name, value):
-        for i in self.components:
-            if i.name == name:
-                await i.on_event(value)
+        component = self._by_name.get(name)
+        if component is None or component.name != name:
+            # Component may have been renamed after creation
+            self._by_name = {i.name: i for i in self.components if i.name is not None}
+            component = self._by_name.get(name)
+
+        if component is not None:
+            await component.on_event(value)
 
     async def on_update(self) -> dict:
         return response("ui", controls=self._to_json())
 
     async def on_ui_event(self, name: str, value: str) -> dict:
         await self._on_event(name, value)
-        if self._rebuild_required():
-            return response("ui", controls=self._to_json())
+        return self.collect_changes()
 
-        updates = self._to_updates()
 
-        if self._rebuild_required():
-            return response("ui", controls=self._to_json())
+def _diff_controls(old, new) -> typing.Optional[dict]:
+    """
+    Returns values that turn old control list into new one or None if they differ in anything but values
+    """
+    if len(old) != len(new):
+        return None
 
-        if updates is not None:
-            return response("update", updates=updates)
+    updates = {}
+    for (old_component, old_data), (component, data) in zip(old, new):
+        if old_data is data or old_data == data:
+            continue
 
-        return response("OK")
+        field = type(component).__value_field__
+        if old_component is not component or field is None or field[1] is None:
+            return None
+
+        old_fields, fields = dict(old_data), dict(data)
+        old_fields.pop(field[1], None)
+        value = fields.pop(field[1], None)
+        if old_fields != fields:
+            return None
+
+        updates[component.name] = value
+
+    return updates
 
 
 class _DeviceDescriptor: